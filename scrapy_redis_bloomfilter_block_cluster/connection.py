@@ -1,4 +1,5 @@
 import six
+import sys
 from scrapy.utils.misc import load_object
 from . import defaults
 """
@@ -68,6 +69,8 @@ def get_redis(**kwargs):
     返回一个 redis 单机实例
     """
     redis_cls = kwargs.pop('redis_cls', defaults.REDIS_CLS)
+    if isinstance(redis_cls, six.string_types):
+        redis_cls = load_object(redis_cls)
     url = kwargs.pop('url', None)
     if url:     # 使用 url 连接时忽略 db 参数
         try:
@@ -118,6 +121,8 @@ def get_redis_cluster(**kwargs):
     返回一个 redis 集群实例
     """
     redis_cluster_cls = kwargs.pop('redis_cluster_cls', defaults.REDIS_CLUSTER_CLS)
+    if isinstance(redis_cluster_cls, six.string_types):
+        redis_cluster_cls = load_object(redis_cluster_cls)
     url = kwargs.pop('url', None)
     # redis cluster 只有 db0，不支持 db 参数
     try:
@@ -165,6 +170,8 @@ def get_redis_sentinel(**kwargs):
     返回一个 redis sentinel实例
     """
     redis_sentinel_cls = kwargs.pop('redis_sentinel_cls', defaults.REDIS_SENTINEL_CLS)
+    if isinstance(redis_sentinel_cls, six.string_types):
+        redis_sentinel_cls = load_object(redis_sentinel_cls)
     sentinel_nodes = kwargs.pop('sentinel_nodes')
     service_name = kwargs.pop('service_name')
     redis_sentinel_conn = redis_sentinel_cls(sentinel_nodes, **kwargs)
@@ -181,3 +188,11 @@ def from_settings(settings):
     elif "REDIS_SENTINEL_NODES" in settings:
         return get_redis_sentinel_from_settings(settings)
     return get_redis_from_settings(settings)
+
+
+def is_redis_cluster(server):
+    """
+    是否为 redis 集群实例，没有导入 rediscluster 时不可能是集群实例，不需要为此导入 rediscluster
+    """
+    rediscluster = sys.modules.get('rediscluster')
+    return rediscluster is not None and isinstance(server, rediscluster.RedisCluster)
@@ -1,6 +1,4 @@
 import redis
-import rediscluster
-from redis import sentinel
 
 # Scheduler default settings
 SCHEDULER_PERSIST = True
@@ -17,13 +15,24 @@ DUPEFILTER_RULES_LIST = []
 DUPEFILTER_LOCK_KEY = '%(spider)s:lock'
 DUPEFILTER_LOCK_NUM = 16    # Redis bloomfilter 锁个数，可以设置值：16，256，4096
 DUPEFILTER_LOCK_TIMEOUT = 15
+DUPEFILTER_LOCK_BACKOFF_MAX = 0.1     # 锁被占用时最长的退避时间（秒）
+DUPEFILTER_ATOMIC = True    # 使用 lua 脚本原子去重，为 True 时不再加锁
+DUPEFILTER_LOCAL_CACHE_SIZE = 0     # 本地 LRU 缓存的指纹个数，0 表示不使用本地缓存
+DUPEFILTER_MIDDLEWARE_BATCH_SIZE = 500     # BatchDupeFilterMiddleware 每批去重的 request 个数
+DUPEFILTER_LIST_WRITE_BEHIND_SIZE = 0    # 列表页去重写回缓冲的大小，0 表示不使用
+DUPEFILTER_LIST_WRITE_BEHIND_INTERVAL = 5   # 列表页去重写回缓冲的最长写入间隔（秒）
+DUPEFILTER_BINARY_FINGERPRINT = False   # 使用 20 字节的二进制指纹代替 40 位 16 进制指纹
 
 SCHEDULER_FLUSH_ON_START = False
 SCHEDULER_IDLE_BEFORE_CLOSE = 0
+SCHEDULER_ASYNC_WINDOW = 100     # AsyncScheduler 待去重的 request 达到此个数时记录到 stats
+SCHEDULER_ASYNC_PREFETCH = 16    # AsyncScheduler 从种子队列预取的 request 个数
 
 CLOSE_EXT_ENABLED =  True
 IDLE_NUMBER_BEFORE_CLOSE = 360  # 一次空闲周期 5s 左右
 
+BLOOMFILTER_STATS_INTERVAL = 0  # BloomFilter 统计扩展的统计间隔（秒），0 表示不启用
+
 # Pipeline default settings
 REDIS_PIPELINE_KEY = '%(spider)s:items'
 REDIS_PIPELINE_SERIALIZER = 'scrapy.utils.serialize.ScrapyJSONEncoder'
@@ -57,13 +66,31 @@ REDIS_SENTINEL_PARAMS = {
     'encoding': REDIS_ENCODING,
 }
 REDIS_CLS = redis.Redis
-REDIS_CLUSTER_CLS = rediscluster.RedisCluster
-REDIS_SENTINEL_CLS = sentinel.Sentinel
+# 集群与哨兵只在使用时才导入（rediscluster 导入较慢），单机部署不需要导入
+REDIS_CLUSTER_CLS = 'rediscluster.RedisCluster'    # redis-py-cluster 2.0.0 版本无 StrictRedisCluster
+REDIS_SENTINEL_CLS = 'redis.sentinel.Sentinel'
 
 # BloomFilter default settings
 BLOOMFILTER_HASH_NUMBER = 15
 BLOOMFILTER_BIT = 32
 BLOOMFILTER_BLOCK_NUM = 1
+BLOOMFILTER_CLASS = 'scrapy_redis_bloomfilter_block_cluster.bloomfilter.BloomFilter'
+# BLOOMFILTER_CLASS 可以使用的去重后端名称，BLOOMFILTER_BACKENDS 设置中可以增加自定义的后端
+BLOOMFILTER_BACKENDS_BASE = {
+    'bitmap': 'scrapy_redis_bloomfilter_block_cluster.bloomfilter.BloomFilter',
+    'blocked': 'scrapy_redis_bloomfilter_block_cluster.bloomfilter.BlockedBloomFilter',
+    'counting': 'scrapy_redis_bloomfilter_block_cluster.bloomfilter.PackedCountBloomFilter',
+    'cuckoo': 'scrapy_redis_bloomfilter_block_cluster.bloomfilter.CuckooFilter',
+    'mmap': 'scrapy_redis_bloomfilter_block_cluster.bloomfilter.MmapBloomFilter',
+    'redisbloom': 'scrapy_redis_bloomfilter_block_cluster.bloomfilter.RedisBloomFilter',
+    'rotating': 'scrapy_redis_bloomfilter_block_cluster.bloomfilter.RotatingBloomFilter',
+    'scalable': 'scrapy_redis_bloomfilter_block_cluster.bloomfilter.ScalableBloomFilter',
+}
+BLOOMFILTER_BLOCK_PLACEMENT = None     # None 或 'slots'，redis 集群中 block 的分布方式
+BLOOMFILTER_BLOCK_ROUTER = None     # None（即 'legacy'）或 'jump'，根据指纹选择 block 的方式
+BLOOMFILTER_PARAMS = {}     # 传递给 BloomFilter 的其他参数，如 hash_scheme
+BLOOMFILTER_PREALLOCATE = False     # 去重类打开时是否预先分配所有 Redis 内存块
+BLOOMFILTER_PREALLOCATE_CHUNK_SIZE = 16 << 20    # 预先分配时每次增长的字节数
 
 BLOOMFILTER_HASH_NUMBER_LIST = 15
 BLOOMFILTER_BIT_LIST = 32
@@ -1,12 +1,110 @@
 import logging
+import random
 import re
+import six
+import time
 from scrapy.dupefilters import BaseDupeFilter
+from scrapy.utils.misc import load_object
 from scrapy.utils.request import request_fingerprint
+from redis.exceptions import ResponseError
 from . import connection, defaults
-from .bloomfilter import BloomFilter
+from .bloomfilter import (LocalCacheFilter, MigratingFilter, WriteBehindFilter, fingerprint_int, get_backend_params,
+                          is_script_unavailable)
 
 logger = logging.getLogger(__name__)
 
+# Request meta key set on requests already checked against the dupefilter,
+# e.g. by ``middlewares.BatchDupeFilterMiddleware``, the scheduler does not
+# check them again.
+CHECKED_META_KEY = 'dupefilter_checked'
+
+# Shortcut maps 'setting name' -> 'parameter name'.
+BLOOMFILTER_SETTINGS_PARAMS_MAP = {
+    'BLOOMFILTER_CLASS': 'bloomfilter_cls',
+    'BLOOMFILTER_HASH_SCHEME': 'hash_scheme',
+    'BLOOMFILTER_USE_BITFIELD': 'use_bitfield',
+    'BLOOMFILTER_BLOCK_PLACEMENT': 'block_placement',
+    'BLOOMFILTER_BLOCK_ROUTER': 'block_router',
+}
+
+
+def get_bloomfilter_params(settings):
+    """Returns the extra BloomFilter parameters from given Scrapy settings object.
+
+    ``defaults.BLOOMFILTER_PARAMS`` is used as defaults values, it can be
+    overridden by the ``BLOOMFILTER_PARAMS`` setting and the shortcut
+    settings in ``BLOOMFILTER_SETTINGS_PARAMS_MAP``.
+
+    Parameters
+    ----------
+    settings : scrapy.settings.Settings
+
+    Returns
+    -------
+    dict
+
+    """
+    params = defaults.BLOOMFILTER_PARAMS.copy()
+    params.update(settings.getdict('BLOOMFILTER_PARAMS'))
+    for setting_name, name in BLOOMFILTER_SETTINGS_PARAMS_MAP.items():
+        val = settings.get(setting_name)
+        if name == 'use_bitfield' and val is not None and val != 'auto':
+            # 显式设置为 False 时也要传递，否则使用默认的 'auto'
+            params[name] = settings.getbool(setting_name)
+        elif val:
+            params[name] = val
+    # Allow ``bloomfilter_cls`` to be a backend name.
+    backends = defaults.BLOOMFILTER_BACKENDS_BASE.copy()
+    backends.update(settings.getdict('BLOOMFILTER_BACKENDS'))
+    if isinstance(params.get('bloomfilter_cls'), six.string_types):
+        params['bloomfilter_cls'] = backends.get(params['bloomfilter_cls'], params['bloomfilter_cls'])
+    return params
+
+
+def set_filter_stats(bf, stats):
+    """Sets the stats collector of given filter and of the local filters it
+    wraps (``LocalCacheFilter``, ``WriteBehindFilter``).
+
+    Parameters
+    ----------
+    bf : BloomFilterBackend
+    stats : scrapy.statscollectors.StatsCollector
+
+    """
+    while isinstance(bf, (LocalCacheFilter, WriteBehindFilter)):
+        bf.stats = stats
+        bf = bf.bf
+
+
+def get_bloomfilter(server, key, bit, hash_number, block_num, **kwargs):
+    """Returns a bloom filter instance.
+
+    ``bloomfilter_cls`` selects the bloom filter class, it can be a class, a
+    path to a class or a name in ``defaults.BLOOMFILTER_BACKENDS_BASE``,
+    defaults to ``defaults.BLOOMFILTER_CLASS``.
+    ``previous`` is a dict of parameters (``block_num``, ``block_router``,
+    ``block_placement``) overriding the current ones for the layout the
+    existing data was written with, the filter is then wrapped in a
+    ``MigratingFilter``. Other keyword arguments are passed to the class,
+    the common parameters (``hash_scheme``, ``use_bitfield``,
+    ``block_placement``, ``block_router``) the class does not accept are
+    ignored, see ``get_backend_params``.
+
+    """
+    bloomfilter_cls = kwargs.pop('bloomfilter_cls', defaults.BLOOMFILTER_CLASS)
+    previous = kwargs.pop('previous', None)
+    # Allow ``bloomfilter_cls`` to be a backend name or a path to a class.
+    if isinstance(bloomfilter_cls, six.string_types):
+        bloomfilter_cls = load_object(defaults.BLOOMFILTER_BACKENDS_BASE.get(bloomfilter_cls, bloomfilter_cls))
+    kwargs = get_backend_params(bloomfilter_cls, kwargs)
+    bf = bloomfilter_cls(server, key, bit, hash_number, block_num, **kwargs)
+    if previous:
+        previous_kwargs = dict(kwargs, **previous)
+        previous_block_num = previous_kwargs.pop('block_num', block_num)
+        previous_kwargs = get_backend_params(bloomfilter_cls, previous_kwargs)
+        bf = MigratingFilter(bf, bloomfilter_cls(server, key, bit, hash_number, previous_block_num, **previous_kwargs))
+    return bf
+
 
 # TODO: Rename class to RedisDupeFilter.
 class RFPDupeFilter(BaseDupeFilter):
@@ -18,7 +116,8 @@ class RFPDupeFilter(BaseDupeFilter):
     
     logger = logger
     
-    def __init__(self, server, key, debug, bit, hash_number, block_num):
+    def __init__(self, server, key, debug, bit, hash_number, block_num, bloomfilter_params=None,
+                 local_cache_size=0, preallocate=False, preallocate_chunk_size=16 << 20, binary_fingerprint=False):
         """Initialize the duplicates filter.
 
         Parameters
@@ -29,6 +128,19 @@ class RFPDupeFilter(BaseDupeFilter):
             Redis key Where to store fingerprints.
         debug : bool, optional
             Whether to log filtered requests.
+        bloomfilter_params : dict, optional
+            Extra keyword arguments passed to ``get_bloomfilter``.
+        local_cache_size : int, optional
+            Size of the in-process LRU cache of seen fingerprints put in
+            front of the bloom filter, 0 disables it.
+        preallocate : bool, optional
+            Whether to allocate the bloom filter blocks to their final size
+            when the dupefilter is opened.
+        preallocate_chunk_size : int, optional
+            Bytes a block grows by per command while preallocating.
+        binary_fingerprint : bool, optional
+            Whether to use the raw 20 bytes sha1 digest as fingerprint
+            instead of the 40 characters hex string.
 
         """
         self.server = server
@@ -37,8 +149,18 @@ class RFPDupeFilter(BaseDupeFilter):
         self.bit = bit
         self.hash_number = hash_number
         self.block_num = block_num
+        self.bloomfilter_params = bloomfilter_params or {}
+        self.local_cache_size = local_cache_size
+        self.preallocate = preallocate
+        self.preallocate_chunk_size = preallocate_chunk_size
+        self.binary_fingerprint = binary_fingerprint
         self.logdupes = True
-        self.bf = BloomFilter(server, self.key, bit, hash_number, block_num)
+        self.stats = None
+        # redis 不能执行 lua 脚本时设置为 False，之后使用 exists + insert 去重
+        self.scripting = True
+        self.bf = get_bloomfilter(server, self.key, bit, hash_number, block_num, **self.bloomfilter_params)
+        if local_cache_size > 0:
+            self.bf = LocalCacheFilter(self.bf, local_cache_size)
     
     @classmethod
     def from_settings(cls, settings):
@@ -65,11 +187,59 @@ class RFPDupeFilter(BaseDupeFilter):
         # TODO: Use SCRAPY_JOB env as default and fallback to timestamp.
         # key = defaults.DUPEFILTER_KEY % {'timestamp': int(time.time())}
         key = settings.get('DUPEFILTER_KEY', defaults.DUPEFILTER_KEY)
-        debug = settings.getbool('DUPEFILTER_DEBUG', defaults.DUPEFILTER_DEBUG)
-        bit = settings.getint('BLOOMFILTER_BIT', defaults.BLOOMFILTER_BIT)
-        hash_number = settings.getint('BLOOMFILTER_HASH_NUMBER', defaults.BLOOMFILTER_HASH_NUMBER)
-        block_num = settings.getint('BLOOMFILTER_BLOCK_NUM', defaults.BLOOMFILTER_BLOCK_NUM)
-        return cls(server=server, key=key, debug=debug, bit=bit, hash_number=hash_number, block_num=block_num)
+        return cls(server=server, key=key, **cls.get_params_from_settings(settings))
+
+    @classmethod
+    def from_spider(cls, server, key, spider):
+        """Returns an instance for given spider, used by the scheduler.
+
+        Parameters
+        ----------
+        server : redis.Redis
+            The redis server instance.
+        key : str
+            Redis key Where to store fingerprints.
+        spider : scrapy.spiders.Spider
+
+        Returns
+        -------
+        RFPDupeFilter
+
+        """
+        return cls(server=server, key=key, **cls.get_params_from_settings(spider.settings, spider))
+
+    @classmethod
+    def get_params_from_settings(cls, settings, spider=None):
+        """Returns the constructor arguments except ``server`` and ``key``.
+
+        Subclasses adding constructor arguments extend this method, so both
+        ``from_settings`` and the scheduler build them the same way.
+
+        Parameters
+        ----------
+        settings : scrapy.settings.Settings
+        spider : scrapy.spiders.Spider, optional
+            When given, ``%(spider)s`` in other redis keys is replaced with
+            the spider name.
+
+        Returns
+        -------
+        dict
+
+        """
+        return {
+            'debug': settings.getbool('DUPEFILTER_DEBUG', defaults.DUPEFILTER_DEBUG),
+            'bit': settings.getint('BLOOMFILTER_BIT', defaults.BLOOMFILTER_BIT),
+            'hash_number': settings.getint('BLOOMFILTER_HASH_NUMBER', defaults.BLOOMFILTER_HASH_NUMBER),
+            'block_num': settings.getint('BLOOMFILTER_BLOCK_NUM', defaults.BLOOMFILTER_BLOCK_NUM),
+            'bloomfilter_params': get_bloomfilter_params(settings),
+            'local_cache_size': settings.getint('DUPEFILTER_LOCAL_CACHE_SIZE', defaults.DUPEFILTER_LOCAL_CACHE_SIZE),
+            'preallocate': settings.getbool('BLOOMFILTER_PREALLOCATE', defaults.BLOOMFILTER_PREALLOCATE),
+            'preallocate_chunk_size': settings.getint('BLOOMFILTER_PREALLOCATE_CHUNK_SIZE',
+                                                      defaults.BLOOMFILTER_PREALLOCATE_CHUNK_SIZE),
+            'binary_fingerprint': settings.getbool('DUPEFILTER_BINARY_FINGERPRINT',
+                                                   defaults.DUPEFILTER_BINARY_FINGERPRINT),
+        }
     
     @classmethod
     def from_crawler(cls, crawler):
@@ -87,7 +257,19 @@ class RFPDupeFilter(BaseDupeFilter):
         """
         instance = cls.from_settings(crawler.settings)
         # FIXME: for now, stats are only supported from this constructor
+        instance.set_stats(crawler.stats)
         return instance
+
+    def set_stats(self, stats):
+        """Sets the stats collector used by the local cache.
+
+        Parameters
+        ----------
+        stats : scrapy.statscollectors.StatsCollector
+
+        """
+        self.stats = stats
+        set_filter_stats(self.bf, stats)
     
     def request_seen(self, request):
         """Returns True if request was already seen.
@@ -103,12 +285,96 @@ class RFPDupeFilter(BaseDupeFilter):
         """
         # scrapy 根据每个请求的 url, method, body, header 生成指纹 fp
         fp = self.request_fingerprint(request)
-        # This returns the number of values added, zero if already exists.
-        if self.bf.exists(fp):
-            return True
-        self.bf.insert(fp)
-        return False
-    
+        # This returns True if all bits were already set before inserting.
+        return self.filter_seen_many(self.bf, [fp])[0]
+
+    def requests_seen(self, requests):
+        """Returns for each request whether it was already seen.
+
+        All fingerprints are checked and inserted in one batch, a request
+        repeated inside ``requests`` is seen from its second occurrence on.
+
+        Parameters
+        ----------
+        requests : list of scrapy.http.Request
+
+        Returns
+        -------
+        list of bool
+
+        """
+        return self.filter_seen_many(self.bf, [self.request_fingerprint(request) for request in requests])
+
+    def filter_seen_many(self, bf, fps):
+        """Checks and inserts fingerprints into given filter, falling back
+        to ``fallback_seen_many`` once the redis server turns out not to
+        run lua scripts (EVAL disabled by ``rename-command`` or ACL).
+
+        Parameters
+        ----------
+        bf : BloomFilterBackend
+        fps : list of str
+
+        Returns
+        -------
+        list of bool
+
+        """
+        if self.scripting:
+            try:
+                return bf.seen_many(fps)
+            except ResponseError as e:
+                if not is_script_unavailable(e):
+                    raise
+                self.logger.warning("Redis can not run lua scripts (%s), falling back to exists + insert, "
+                                    "which is not atomic between scrapy instances", e)
+                self.scripting = False
+        return self.fallback_seen_many(bf, fps)
+
+    def fallback_seen_many(self, bf, fps):
+        """Checks and inserts fingerprints without lua scripts, a
+        fingerprint repeated inside ``fps`` is seen from its second
+        occurrence on.
+
+        Parameters
+        ----------
+        bf : BloomFilterBackend
+        fps : list of str
+
+        Returns
+        -------
+        list of bool
+
+        """
+        results = bf.exists_many(fps)
+        unseen = set()
+        for index, fp in enumerate(fps):
+            if not fp or results[index]:
+                continue
+            if fp in unseen:
+                results[index] = True
+            unseen.add(fp)
+        bf.insert_many(list(unseen))
+        return results
+
+    def request_forget(self, request):
+        """Removes a request from the seen requests, so it can be crawled again.
+
+        Only bloom filter classes supporting deletion, such as
+        ``CuckooFilter``, implement this.
+
+        Parameters
+        ----------
+        request : scrapy.http.Request
+
+        Returns
+        -------
+        bool
+            True if the request was seen before.
+
+        """
+        return self.bf.remove(self.request_fingerprint(request))
+
     def request_fingerprint(self, request):
         """Returns a fingerprint for a given request.
 
@@ -118,11 +384,45 @@ class RFPDupeFilter(BaseDupeFilter):
 
         Returns
         -------
-        str
+        str or bytes
+            The digest bytes when ``binary_fingerprint`` is enabled.
 
         """
+        if self.binary_fingerprint:
+            return bytes.fromhex(request_fingerprint(request))
         return request_fingerprint(request)
     
+    def open(self):
+        """Preallocates the bloom filter blocks when enabled. Called by the
+        scheduler after flushing on start.
+
+        Raises ``ValueError`` when redis ``maxmemory`` can not hold all the
+        blocks, so the crawl fails before it starts.
+
+        """
+        if self.preallocate:
+            self.preallocate_bloomfilter(self.bf)
+
+    def preallocate_bloomfilter(self, bf):
+        """Allocates the blocks of given bloom filter to their final size.
+
+        Parameters
+        ----------
+        bf : BloomFilterBackend
+
+        """
+        if not hasattr(bf, 'preallocate'):
+            self.logger.warning("%s does not support preallocation", bf.__class__.__name__)
+            return
+
+        def progress(block, done, total):
+            if done == total:
+                self.logger.info("Preallocated bloom filter %s block %d (%d bytes)", bf.key, block, total)
+
+        start = time.time()
+        allocated = bf.preallocate(self.preallocate_chunk_size, progress)
+        self.logger.info("Preallocated %d bytes for bloom filter %s in %.1fs", allocated, bf.key, time.time() - start)
+
     def close(self, reason=''):
         """Delete data on close. Called by Scrapy's scheduler.
 
@@ -135,8 +435,12 @@ class RFPDupeFilter(BaseDupeFilter):
     
     def clear(self):
         """Clears fingerprints data."""
-        keys = [self.key + str(num) for num in range(self.block_num)]
-        self.server.delete(*keys)
+        self.bf.clear()
+
+    def flush_buffer(self):
+        """Writes buffered fingerprints to redis. Called by the scheduler on
+        close, subclasses buffering inserts override it.
+        """
     
     def log(self, request, spider):
         """Logs given request.
@@ -162,85 +466,136 @@ class RFPDupeFilter(BaseDupeFilter):
 class LockRFPDupeFilter(RFPDupeFilter):
     """
     去重时，先加锁，会降低性能，但是可以保证数据正确性
+    atomic 为 True 时使用 lua 脚本原子去重（BloomFilter.test_and_set），同样能保证数据正确性，且不再需要加锁。
+    锁被占用时不再循环 SET NX，而是随机退避后重试，退避时间从 LOCK_BACKOFF_BASE 秒开始每次翻倍，最多 lock_backoff_max 秒
     """
-    def __init__(self,  lock_key, lock_num, lock_timeout, **kwargs):
+    LOCK_BACKOFF_BASE = 0.001
+
+    def __init__(self,  lock_key, lock_num, lock_timeout, atomic=True, lock_backoff_max=0.1, **kwargs):
         super().__init__(**kwargs)
+        self.atomic = atomic
+        self.lock_backoff_max = lock_backoff_max
         if lock_num <= 16:
             self.lock_value_split_num = 1
         elif 16 < lock_num <= 256:
             self.lock_value_split_num = 2
         else:
             self.lock_value_split_num = 3
-        self.lock = list()
-        # 初始化 N 把锁，最多 4096，缓解多个 scrapy 实例抢一个锁带来的性能下降问题
-        for i in range(0, int('f' * self.lock_value_split_num, 16) + 1):
-            self.lock.append(self.server.lock(lock_key + str(i), lock_timeout))
+        self.lock_key = lock_key
+        self.lock_timeout = lock_timeout
+        # N 把锁，最多 4096，缓解多个 scrapy 实例抢一个锁带来的性能下降问题，第一次使用时才创建
+        self.locks = {}
 
     @classmethod
-    def from_settings(cls, settings):
-        server = connection.from_settings(settings)
-        key = settings.get('DUPEFILTER_KEY', defaults.DUPEFILTER_KEY)
-        debug = settings.getbool('DUPEFILTER_DEBUG', defaults.DUPEFILTER_DEBUG)
-        bit = settings.getint('BLOOMFILTER_BIT', defaults.BLOOMFILTER_BIT)
-        hash_number = settings.getint('BLOOMFILTER_HASH_NUMBER', defaults.BLOOMFILTER_HASH_NUMBER)
-        block_num = settings.getint('BLOOMFILTER_BLOCK_NUM', defaults.BLOOMFILTER_BLOCK_NUM)
+    def get_params_from_settings(cls, settings, spider=None):
+        params = super().get_params_from_settings(settings, spider)
         lock_key = settings.get('DUPEFILTER_LOCK_KEY', defaults.DUPEFILTER_LOCK_KEY)
-        lock_num = settings.getint('DUPEFILTER_LOCK_NUM', defaults.DUPEFILTER_LOCK_NUM)
-        lock_timeout = settings.getint('DUPEFILTER_LOCK_TIMEOUT', defaults.DUPEFILTER_LOCK_TIMEOUT)
-        return cls(
-            server=server, key=key, debug=debug, bit=bit, hash_number=hash_number,
-            block_num=block_num, lock_key=lock_key, lock_num=lock_num, lock_timeout=lock_timeout
+        params.update(
+            lock_key=lock_key % {'spider': spider.name} if spider else lock_key,
+            lock_num=settings.getint('DUPEFILTER_LOCK_NUM', defaults.DUPEFILTER_LOCK_NUM),
+            lock_timeout=settings.getint('DUPEFILTER_LOCK_TIMEOUT', defaults.DUPEFILTER_LOCK_TIMEOUT),
+            atomic=settings.getbool('DUPEFILTER_ATOMIC', defaults.DUPEFILTER_ATOMIC),
+            lock_backoff_max=settings.getfloat('DUPEFILTER_LOCK_BACKOFF_MAX', defaults.DUPEFILTER_LOCK_BACKOFF_MAX),
         )
+        return params
+
+    def requests_seen(self, requests):
+        if self.atomic:
+            return super().requests_seen(requests)
+        return [self.request_seen(request) for request in requests]
 
     def request_seen(self, request):
-        fp = self.request_fingerprint(request)
-        # 根据 request 生成的 sha1 选择相应的锁
-        lock = self.lock[int(fp[0:self.lock_value_split_num], 16)]
+        if self.atomic:
+            return super().request_seen(request)
+
+        return self.locked_seen(self.request_fingerprint(request))
+
+    def get_lock(self, fp):
+        """
+        根据 request 生成的 sha1 选择相应的锁
+        """
+        index = fingerprint_int(fp, 0, self.lock_value_split_num)
+        lock = self.locks.get(index)
+        if lock is None:
+            lock = self.locks[index] = self.server.lock(self.lock_key + str(index), self.lock_timeout)
+        return lock
 
+    def acquire_lock(self, lock):
+        """
+        获取锁，被占用时随机退避（full jitter）后重试，等待时间与竞争次数记录在 scrapy stats 的
+        bloomfilter/lock/wait_time 与 bloomfilter/lock/contention 中
+        """
+        if lock.acquire(blocking=False):
+            return
+        start = time.time()
+        backoff = self.LOCK_BACKOFF_BASE
         while True:
+            time.sleep(random.uniform(0, backoff))
             if lock.acquire(blocking=False):
-                if self.bf.exists(fp):
-                    lock.release()
-                    return True
-                self.bf.insert(fp)
-                lock.release()
-                return False
+                break
+            backoff = min(backoff * 2, self.lock_backoff_max)
+        if self.stats:
+            self.stats.inc_value('bloomfilter/lock/contention')
+            self.stats.inc_value('bloomfilter/lock/wait_time', time.time() - start)
+
+    def fallback_seen_many(self, bf, fps):
+        """
+        不能执行 lua 脚本时，去重实例的 BloomFilter 加锁判断
+        """
+        if bf is not self.bf:
+            return super().fallback_seen_many(bf, fps)
+        return [self.locked_seen(fp) for fp in fps]
+
+    def locked_seen(self, fp):
+        """
+        加锁判断 fp 是否存在，不存在时插入
+        """
+        lock = self.get_lock(fp)
+        self.acquire_lock(lock)
+        try:
+            if self.bf.exists(fp):
+                return True
+            self.bf.insert(fp)
+            return False
+        finally:
+            lock.release()
 
 
 class ListLockRFPDupeFilter(LockRFPDupeFilter):
-    def __init__(self, rules_list, key_list, bit_list, hash_number_list, block_num_list, **kwargs):
+    def __init__(self, rules_list, key_list, bit_list, hash_number_list, block_num_list, write_behind_size=0,
+                 write_behind_interval=5, **kwargs):
         self.rules_list = rules_list
         self.key_list = key_list
         self.bit_list = bit_list
         self.hash_number_list = hash_number_list
         self.block_num_list = block_num_list
+        self.write_behind_size = write_behind_size
         super().__init__(**kwargs)
-        self.bf_list = BloomFilter(self.server, key_list, bit_list, hash_number_list, block_num_list)
+        self.bf_list = get_bloomfilter(self.server, key_list, bit_list, hash_number_list, block_num_list,
+                                       **self.bloomfilter_params)
+        # 列表页可以容忍几秒的延迟，write_behind_size 大于 0 时插入先放在本地缓冲中，批量写入 redis
+        if write_behind_size > 0:
+            self.bf_list = WriteBehindFilter(self.bf_list, write_behind_size, write_behind_interval)
+        if self.local_cache_size > 0:
+            self.bf_list = LocalCacheFilter(self.bf_list, self.local_cache_size)
 
     @classmethod
-    def from_settings(cls, settings):
-        server = connection.from_settings(settings)
-        key = settings.get('DUPEFILTER_KEY', defaults.DUPEFILTER_KEY)
-        debug = settings.getbool('DUPEFILTER_DEBUG', defaults.DUPEFILTER_DEBUG)
-        bit = settings.getint('BLOOMFILTER_BIT', defaults.BLOOMFILTER_BIT)
-        hash_number = settings.getint('BLOOMFILTER_HASH_NUMBER', defaults.BLOOMFILTER_HASH_NUMBER)
-        block_num = settings.getint('BLOOMFILTER_BLOCK_NUM', defaults.BLOOMFILTER_BLOCK_NUM)
-        lock_key = settings.get('DUPEFILTER_LOCK_KEY', defaults.DUPEFILTER_LOCK_KEY)
-        lock_num = settings.getint('DUPEFILTER_LOCK_NUM', defaults.DUPEFILTER_LOCK_NUM)
-        lock_timeout = settings.getint('DUPEFILTER_LOCK_TIMEOUT', defaults.DUPEFILTER_LOCK_TIMEOUT)
-
-        rules_list = settings.get('DUPEFILTER_RULES_LIST', defaults.DUPEFILTER_RULES_LIST)
+    def get_params_from_settings(cls, settings, spider=None):
+        params = super().get_params_from_settings(settings, spider)
         key_list = settings.get('DUPEFILTER_KEY_LIST', defaults.DUPEFILTER_KEY_LIST)
-        bit_list = settings.getint('BLOOMFILTER_BIT_LIST', defaults.BLOOMFILTER_BIT_LIST)
-        hash_number_list = settings.getint('BLOOMFILTER_HASH_NUMBER_LIST', defaults.BLOOMFILTER_HASH_NUMBER_LIST)
-        block_num_list = settings.getint('BLOOMFILTER_BLOCK_NUM_LIST', defaults.BLOOMFILTER_BLOCK_NUM_LIST)
-
-        return cls(
-            server=server, key=key, debug=debug, bit=bit, hash_number=hash_number,
-            block_num=block_num, lock_key=lock_key, lock_num=lock_num, lock_timeout=lock_timeout,
-            rules_list=rules_list, key_list=key_list, bit_list=bit_list,
-            hash_number_list=hash_number_list, block_num_list=block_num_list
+        params.update(
+            rules_list=spider.rules_list if spider else settings.get('DUPEFILTER_RULES_LIST',
+                                                                     defaults.DUPEFILTER_RULES_LIST),
+            key_list=key_list % {'spider': spider.name} if spider else key_list,
+            bit_list=settings.getint('BLOOMFILTER_BIT_LIST', defaults.BLOOMFILTER_BIT_LIST),
+            hash_number_list=settings.getint('BLOOMFILTER_HASH_NUMBER_LIST', defaults.BLOOMFILTER_HASH_NUMBER_LIST),
+            block_num_list=settings.getint('BLOOMFILTER_BLOCK_NUM_LIST', defaults.BLOOMFILTER_BLOCK_NUM_LIST),
+            write_behind_size=settings.getint('DUPEFILTER_LIST_WRITE_BEHIND_SIZE',
+                                              defaults.DUPEFILTER_LIST_WRITE_BEHIND_SIZE),
+            write_behind_interval=settings.getfloat('DUPEFILTER_LIST_WRITE_BEHIND_INTERVAL',
+                                                    defaults.DUPEFILTER_LIST_WRITE_BEHIND_INTERVAL),
         )
+        return params
 
     def request_seen(self, request):
         """
@@ -250,18 +605,49 @@ class ListLockRFPDupeFilter(LockRFPDupeFilter):
 
         for rule in self.rules_list:
             if re.search(rule, request.url, re.I):
-                if self.bf_list.exists(fp):
-                    return True
-                self.bf_list.insert(fp)
-                return False
+                return self.filter_seen_many(self.bf_list, [fp])[0]
         else:
-            # 根据 request 生成的 sha1 选择相应的锁
-            lock = self.lock[int(fp[0:self.lock_value_split_num], 16)]
-            while 1:
-                if lock.acquire(blocking=False):
-                    if self.bf.exists(fp):
-                        lock.release()
-                        return True
-                    self.bf.insert(fp)
-                    lock.release()
-                    return False
+            if self.atomic:
+                return self.filter_seen_many(self.bf, [fp])[0]
+            return self.locked_seen(fp)
+
+    def requests_seen(self, requests):
+        """
+        列表页与其他页面分别批量去重
+        """
+        results = [False] * len(requests)
+        list_indexes = []
+        other_indexes = []
+        for index, request in enumerate(requests):
+            for rule in self.rules_list:
+                if re.search(rule, request.url, re.I):
+                    list_indexes.append(index)
+                    break
+            else:
+                other_indexes.append(index)
+
+        if list_indexes:
+            fps = [self.request_fingerprint(requests[index]) for index in list_indexes]
+            for index, seen in zip(list_indexes, self.filter_seen_many(self.bf_list, fps)):
+                results[index] = seen
+        if other_indexes:
+            others = [requests[index] for index in other_indexes]
+            for index, seen in zip(other_indexes, super().requests_seen(others)):
+                results[index] = seen
+        return results
+
+    def open(self):
+        super().open()
+        if self.preallocate:
+            self.preallocate_bloomfilter(self.bf_list)
+
+    def set_stats(self, stats):
+        super().set_stats(stats)
+        set_filter_stats(self.bf_list, stats)
+
+    def flush_buffer(self):
+        """
+        将列表页去重的写回缓冲写入 redis
+        """
+        if self.write_behind_size > 0:
+            self.bf_list.flush()
@@ -2,8 +2,10 @@
 
 # Define here the models for your scraped Extensions
 import logging
+import math
 from scrapy import signals
 from scrapy.exceptions import NotConfigured
+from twisted.internet import task, threads
 from . import defaults
 import traceback
 
@@ -60,11 +62,18 @@ class RedisSpiderSmartIdleClosedExensions(object):
             # 关闭爬虫前删除列表页去重 key
             if self.list_spider:
                 key_list = self.crawler.settings.get('DUPEFILTER_KEY_LIST', defaults.DUPEFILTER_KEY_LIST) % {'spider': spider.name}
-                block_num_list = self.crawler.settings.getint('BLOOMFILTER_BLOCK_NUM_LIST', defaults.BLOOMFILTER_BLOCK_NUM_LIST)
-                keys_list = [key_list + str(num) for num in range(block_num_list)]
-                logger.info("delete spider %s list bloomfilter key: %s", spider.name, ','.join(keys_list))
+                # 通过调度器的去重实例删除，同时清空写回缓冲，关闭调度器时不会再写入
+                df = getattr(self.crawler.engine.slot.scheduler, 'df', None)
+                bf_list = getattr(df, 'bf_list', None)
                 try:
-                    spider.server.delete(*keys_list)
+                    if bf_list is not None:
+                        logger.info("delete spider %s list bloomfilter key: %s", spider.name, key_list)
+                        bf_list.clear()
+                    else:
+                        block_num_list = self.crawler.settings.getint('BLOOMFILTER_BLOCK_NUM_LIST', defaults.BLOOMFILTER_BLOCK_NUM_LIST)
+                        keys_list = [key_list + str(num) for num in range(block_num_list)]
+                        logger.info("delete spider %s list bloomfilter key: %s", spider.name, ','.join(keys_list))
+                        spider.server.delete(*keys_list)
                 except Exception:
                     logger.error(traceback.format_exc())
             # 执行关闭爬虫操作
@@ -73,3 +82,54 @@ class RedisSpiderSmartIdleClosedExensions(object):
     def request_scheduled(self, spider):
         self.idle_count = 0
         # logger.info("spider %s redis spider Idle Num set to 0", spider.name)
+
+
+class BloomFilterStatsExtension(object):
+    """
+    每隔 BLOOMFILTER_STATS_INTERVAL 秒统计一次调度器去重实例的 BloomFilter（分段 BITCOUNT，在线程中执行，不阻塞
+    twisted reactor），将置为 1 的位所占比例、估算的已插入数据量以及当前误报率记录到 scrapy stats 并输出日志
+    get_stats 与 reactor 线程同时使用同一个去重后端，会改变本地状态的后端（ScalableBloomFilter、RotatingBloomFilter）
+    需要在 get_stats 中加锁
+    """
+    def __init__(self, crawler, interval):
+        self.crawler = crawler
+        self.interval = interval
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        interval = crawler.settings.getfloat('BLOOMFILTER_STATS_INTERVAL', defaults.BLOOMFILTER_STATS_INTERVAL)
+        if interval <= 0:
+            raise NotConfigured('BLOOMFILTER_STATS_INTERVAL setting must > 0')
+        ext = cls(crawler, interval)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        self.task = task.LoopingCall(self.update_stats, spider)
+        self.task.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.task and self.task.running:
+            self.task.stop()
+
+    def update_stats(self, spider):
+        df = getattr(self.crawler.engine.slot.scheduler, 'df', None)
+        if df is None or not hasattr(df.bf, 'get_stats'):
+            return
+        # 返回 deferred，上一次统计完成前 LoopingCall 不会开始下一次
+        d = threads.deferToThread(df.bf.get_stats)
+        d.addCallback(self.publish_stats, spider)
+        d.addErrback(lambda failure: logger.error('Failed to get bloomfilter stats: %s', failure.getTraceback()))
+        return d
+
+    def publish_stats(self, stats, spider):
+        for name in ('fill_ratio', 'estimated_count', 'error_rate'):
+            self.crawler.stats.set_value('bloomfilter/%s' % name, stats[name], spider=spider)
+        # estimated_count 在位数组全部置为 1 时为 inf，不能使用 %d
+        estimated_count = stats['estimated_count']
+        if not math.isinf(estimated_count):
+            estimated_count = int(estimated_count)
+        logger.info("Bloomfilter of spider %s: fill ratio %.4f, estimated count %s, error rate %.8f",
+                    spider.name, stats['fill_ratio'], estimated_count, stats['error_rate'])
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+spider 中间件，在 request 进入调度器之前批量去重：
+SPIDER_MIDDLEWARES = {
+    'scrapy_redis_bloomfilter_block_cluster.middlewares.BatchDupeFilterMiddleware': 50,
+}
+"""
+from scrapy.http import Request
+from . import defaults
+from .dupefilter import CHECKED_META_KEY
+from .scheduler import Scheduler
+
+
+class BatchDupeFilterMiddleware(object):
+    """
+    批量去重 spider 中间件，收集一个回调输出的 request（每 batch_size 个一批），通过调度器去重实例的 requests_seen
+    一次完成判断与插入，重复的 request 直接丢弃，不会进入调度器；其余的 request 在 meta 中标记已去重，调度器不会再次去重。
+    一个列表页输出几百个链接时只需要几次 redis 往返，而不是每个链接一次。dont_filter 的 request 不去重，原样输出，
+    item 等其他输出也原样输出
+    """
+    def __init__(self, crawler, batch_size):
+        self.crawler = crawler
+        self.batch_size = batch_size
+        self.scheduler = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        batch_size = crawler.settings.getint('DUPEFILTER_MIDDLEWARE_BATCH_SIZE',
+                                             defaults.DUPEFILTER_MIDDLEWARE_BATCH_SIZE)
+        return cls(crawler, batch_size)
+
+    def get_dupefilter(self):
+        # 只有本项目的调度器会跳过已经去重过的 request，其他调度器会把它们判断为重复
+        scheduler = getattr(self.crawler.engine.slot, 'scheduler', None)
+        if not isinstance(scheduler, Scheduler) or not hasattr(scheduler.df, 'requests_seen'):
+            return None
+        self.scheduler = scheduler
+        return scheduler.df
+
+    def process_spider_output(self, response, result, spider):
+        df = self.get_dupefilter()
+        if df is None:
+            # 不是本项目的调度器时不做处理
+            for element in result:
+                yield element
+            return
+        requests = []
+        for element in result:
+            if isinstance(element, Request) and not element.dont_filter:
+                requests.append(element)
+                if len(requests) >= self.batch_size:
+                    for request in self.filter_requests(df, requests, spider):
+                        yield request
+                    requests = []
+            else:
+                yield element
+        if requests:
+            for request in self.filter_requests(df, requests, spider):
+                yield request
+
+    def filter_requests(self, df, requests, spider):
+        """
+        返回不重复的 request，并在 meta 中标记已去重
+        """
+        survivors = []
+        # AsyncScheduler 在后台线程中使用去重实例，需要持有它的锁。后台线程正在去重时不在 reactor 线程中等待，
+        # 原样输出这一批 request，由调度器去重
+        lock = getattr(self.scheduler, 'enqueue_lock', None)
+        if lock is None:
+            results = df.requests_seen(requests)
+        elif lock.acquire(blocking=False):
+            try:
+                results = df.requests_seen(requests)
+            finally:
+                lock.release()
+        else:
+            if self.crawler.stats:
+                self.crawler.stats.inc_value('dupefilter_middleware/deferred', spider=spider)
+            return requests
+        for request, seen in zip(requests, results):
+            if seen:
+                df.log(request, spider)
+            else:
+                request.meta[CHECKED_META_KEY] = True
+                survivors.append(request)
+        return survivors
@@ -1,9 +1,9 @@
-from rediscluster import RedisCluster       # redis-py-cluster 2.0.0 版本无 StrictRedisCluster
 from scrapy.utils.reqser import request_to_dict, request_from_dict, _find_method, _get_method
 from scrapy.http import Request
 from scrapy.utils.python import to_unicode, to_native_str
 from scrapy.utils.misc import load_object
 from . import picklecompat
+from .connection import is_redis_cluster
 
 
 class Base(object):
@@ -100,7 +100,7 @@ class PriorityQueue(Base):
         Pop a request
         timeout not support in this queue class
         """
-        if not isinstance(self.server, RedisCluster):
+        if not is_redis_cluster(self.server):
             # use atomic range/remove using multi/exec
             pipe = self.server.pipeline()
             pipe.multi()
@@ -1,10 +1,18 @@
 import importlib
-import six
+import logging
+import threading
+import time
+from collections import deque
 
+import six
 from scrapy.utils.misc import load_object
+from twisted.internet import threads
+from twisted.python.threadpool import ThreadPool
 
 from . import connection, defaults
+from .dupefilter import CHECKED_META_KEY
 
+logger = logging.getLogger(__name__)
 
 # TODO: add SCRAPY_JOB support.
 class Scheduler(object):
@@ -72,6 +80,14 @@ class Scheduler(object):
     
     @classmethod
     def from_settings(cls, settings):
+        server = connection.from_settings(settings)
+        return cls(server=server, **cls.get_params_from_settings(settings))
+
+    @classmethod
+    def get_params_from_settings(cls, settings):
+        """
+        返回除 server 以外的构造参数，子类增加构造参数时扩展此方法
+        """
         kwargs = {
             'persist': defaults.SCHEDULER_PERSIST,
             'flush_on_start': defaults.SCHEDULER_FLUSH_ON_START,
@@ -96,9 +112,7 @@ class Scheduler(object):
             val = settings.get(setting_name)
             if val:
                 kwargs[name] = val
-
-        server = connection.from_settings(settings)
-        return cls(server=server, **kwargs)
+        return kwargs
     
     @classmethod
     def from_crawler(cls, crawler):
@@ -121,56 +135,33 @@ class Scheduler(object):
                              self.queue_cls, e)
         
         try:
-            if self.dupefilter_cls == 'scrapy_redis_bloomfilter_block_cluster.dupefilter.LockRFPDupeFilter':
-                self.df = load_object(self.dupefilter_cls)(
-                    server=self.server,
-                    key=self.dupefilter_key % {'spider': spider.name},
-                    debug=spider.settings.getbool('DUPEFILTER_DEBUG', defaults.DUPEFILTER_DEBUG),
-                    bit=spider.settings.getint('BLOOMFILTER_BIT', defaults.BLOOMFILTER_BIT),
-                    hash_number=spider.settings.getint('BLOOMFILTER_HASH_NUMBER', defaults.BLOOMFILTER_HASH_NUMBER),
-                    block_num=spider.settings.getint('BLOOMFILTER_BLOCK_NUM', defaults.BLOOMFILTER_BLOCK_NUM),
-                    lock_key=spider.settings.get('DUPEFILTER_LOCK_KEY', defaults.DUPEFILTER_LOCK_KEY) % {'spider': spider.name},
-                    lock_num=spider.settings.getint('DUPEFILTER_LOCK_NUM', defaults.DUPEFILTER_LOCK_NUM),
-                    lock_timeout=spider.settings.getint('DUPEFILTER_LOCK_TIMEOUT', defaults.DUPEFILTER_LOCK_TIMEOUT)
-                )
-            elif self.dupefilter_cls == 'scrapy_redis_bloomfilter_block_cluster.dupefilter.ListLockRFPDupeFilter':
-                self.df = load_object(self.dupefilter_cls)(
-                    server=self.server,
-                    key=self.dupefilter_key % {'spider': spider.name},
-                    debug=spider.settings.getbool('DUPEFILTER_DEBUG', defaults.DUPEFILTER_DEBUG),
-                    bit=spider.settings.getint('BLOOMFILTER_BIT', defaults.BLOOMFILTER_BIT),
-                    hash_number=spider.settings.getint('BLOOMFILTER_HASH_NUMBER', defaults.BLOOMFILTER_HASH_NUMBER),
-                    block_num=spider.settings.getint('BLOOMFILTER_BLOCK_NUM', defaults.BLOOMFILTER_BLOCK_NUM),
-                    lock_key=spider.settings.get('DUPEFILTER_LOCK_KEY', defaults.DUPEFILTER_LOCK_KEY) % {'spider': spider.name},
-                    lock_num=spider.settings.getint('DUPEFILTER_LOCK_NUM', defaults.DUPEFILTER_LOCK_NUM),
-                    lock_timeout=spider.settings.getint('DUPEFILTER_LOCK_TIMEOUT', defaults.DUPEFILTER_LOCK_TIMEOUT),
-                    rules_list=spider.rules_list,
-                    key_list=spider.settings.get('DUPEFILTER_KEY_LIST', defaults.DUPEFILTER_KEY_LIST) % {'spider': spider.name},
-                    bit_list=spider.settings.getint('BLOOMFILTER_BIT_LIST', defaults.BLOOMFILTER_BIT_LIST),
-                    hash_number_list=spider.settings.getint('BLOOMFILTER_HASH_NUMBER_LIST', defaults.BLOOMFILTER_HASH_NUMBER_LIST),
-                    block_num_list=spider.settings.getint('BLOOMFILTER_BLOCK_NUM_LIST', defaults.BLOOMFILTER_BLOCK_NUM_LIST)
-                )
-            else:
-                self.df = load_object(self.dupefilter_cls)(
-                    server=self.server,
-                    key=self.dupefilter_key % {'spider': spider.name},
-                    debug=spider.settings.getbool('DUPEFILTER_DEBUG', defaults.DUPEFILTER_DEBUG),
-                    bit=spider.settings.getint('BLOOMFILTER_BIT', defaults.BLOOMFILTER_BIT),
-                    hash_number=spider.settings.getint('BLOOMFILTER_HASH_NUMBER', defaults.BLOOMFILTER_HASH_NUMBER),
-                    block_num=spider.settings.getint('BLOOMFILTER_BLOCK_NUM', defaults.BLOOMFILTER_BLOCK_NUM)
-                )
+            # 各个去重类通过 get_params_from_settings 读取自己需要的配置
+            self.df = load_object(self.dupefilter_cls).from_spider(
+                server=self.server,
+                key=self.dupefilter_key % {'spider': spider.name},
+                spider=spider
+            )
         except TypeError as e:
             raise ValueError("Failed to instantiate dupefilter class '%s': %s",
                              self.dupefilter_cls, e)
         
+        if self.stats:
+            self.df.set_stats(self.stats)
+
         if self.flush_on_start:
             self.flush()
+
+        # 清空之后再预先分配 Redis 内存块（BLOOMFILTER_PREALLOCATE）
+        self.df.open()
             
         # notice if there are requests already in the queue to resume the crawl
         if len(self.queue):
             spider.log("Resuming crawl from redis(%d requests scheduled)" % len(self.queue))
     
     def close(self, reason):
+        # 写入去重实例缓冲中的指纹，使用 scrapy 自带的去重类时没有此方法
+        if hasattr(self.df, 'flush_buffer'):
+            self.df.flush_buffer()
         if not self.persist:
             self.flush()
     
@@ -178,8 +169,16 @@ class Scheduler(object):
         self.df.clear()
         self.queue.clear()
     
+    def should_filter(self, request):
+        """
+        是否需要去重，dont_filter 以及已经去重过（meta 中有 CHECKED_META_KEY）的 request 不需要。
+        同时删除 meta 中的标记，之后由这个 request 生成的 request（如重定向）仍然需要去重
+        """
+        checked = request.meta.pop(CHECKED_META_KEY, False)
+        return not request.dont_filter and not checked
+
     def enqueue_request(self, request):
-        if not request.dont_filter and self.df.request_seen(request):
+        if self.should_filter(request) and self.df.request_seen(request):
             self.df.log(request, self.spider)
             return False
         if self.stats:
@@ -195,3 +194,180 @@ class Scheduler(object):
     
     def has_pending_requests(self):
         return len(self) > 0
+
+
+class AsyncScheduler(Scheduler):
+    """
+    异步调度器，去重与种子队列的 redis 操作在单独的线程池中执行，不在 twisted reactor 线程中等待 redis，
+    redis 的网络延迟（或者集群故障转移）不会卡住下载与解析。
+    enqueue_request 只把 request 放入待去重列表并返回 True，后台线程每次取出所有待去重的 request 批量去重
+    （requests_seen）后入队，重复的 request 在回到 reactor 线程后记录日志，因此不会发送 request_dropped 信号。
+    待去重以及正在去重的 request 达到 window 个时（redis 跟不上爬取速度）记录在 scrapy stats 中，不在 reactor 线程中
+    等待后台线程，待去重的 request 在后台线程完成当前批次后作为一批去重。
+    next_request 从本地预取的 request 中返回，不足 prefetch 个时在后台线程中从种子队列预取，预取完成后唤醒 engine。
+    种子队列的长度由后台线程在入队、预取后更新，__len__ 与 has_pending_requests 不在 reactor 线程中访问 redis
+    """
+
+    POP_TIMEOUT = 1
+
+    def __init__(self, *args, window=100, prefetch=16, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.window = window
+        self.prefetch = prefetch
+        self.crawler = None
+        self.threadpool = None
+        # 去重与入队只在持有此锁时执行，后台线程、关闭时的同步入队与批量去重中间件不会同时使用去重实例
+        self.enqueue_lock = threading.Lock()
+        self.pending = []
+        self.enqueuing = []
+        self.prefetched = deque()
+        self.popping = False
+        self.queue_length = 0
+
+    def __len__(self):
+        return self.queue_length + len(self.prefetched) + len(self.pending) + len(self.enqueuing)
+
+    @classmethod
+    def get_params_from_settings(cls, settings):
+        kwargs = super().get_params_from_settings(settings)
+        kwargs.update(
+            window=settings.getint('SCHEDULER_ASYNC_WINDOW', defaults.SCHEDULER_ASYNC_WINDOW),
+            prefetch=settings.getint('SCHEDULER_ASYNC_PREFETCH', defaults.SCHEDULER_ASYNC_PREFETCH),
+        )
+        return kwargs
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        instance = super().from_crawler(crawler)
+        instance.crawler = crawler
+        return instance
+
+    def open(self, spider):
+        super().open(spider)
+        self.queue_length = len(self.queue)
+        # 一个线程去重入队，一个线程预取
+        self.threadpool = ThreadPool(2, 2, 'AsyncScheduler')
+        self.threadpool.start()
+
+    def close(self, reason):
+        # 等待后台线程执行完正在执行的去重与预取（预取最多再阻塞 POP_TIMEOUT 秒），剩余的 request 同步入队，
+        # 预取但没有返回给 engine 的 request 放回种子队列
+        self.popping = False
+        if self.threadpool is not None:
+            self.threadpool.stop()
+            self.threadpool = None
+        self.enqueuing = []
+        if self.pending:
+            self.enqueue_finished(self.enqueue_many(self.pending), self.pending)
+            self.pending = []
+        while self.prefetched:
+            self.queue.push(self.prefetched.popleft())
+        super().close(reason)
+
+    def defer_to_thread(self, func, *args):
+        # 不在模块导入时导入 reactor，避免在 scrapy 安装 reactor 之前安装默认的 reactor
+        from twisted.internet import reactor
+        return threads.deferToThreadPool(reactor, self.threadpool, func, *args)
+
+    def enqueue_request(self, request):
+        """
+        总是返回 True（此时还没有去重），之后判断为重复的 request 记录在 scrapy stats 的 scheduler/async/dropped 中
+        """
+        self.pending.append(request)
+        if len(self.pending) + len(self.enqueuing) == self.window and self.stats:
+            self.stats.inc_value('scheduler/async/window_full', spider=self.spider)
+        if not self.enqueuing:
+            self.start_enqueue()
+        return True
+
+    def start_enqueue(self):
+        self.enqueuing, self.pending = self.pending, []
+        d = self.defer_to_thread(self.enqueue_many, self.enqueuing)
+        d.addCallback(self.enqueue_finished, self.enqueuing)
+        d.addErrback(lambda failure: logger.error('Failed to enqueue requests: %s', failure.getTraceback()))
+        d.addBoth(self.enqueue_done)
+
+    def enqueue_done(self, _):
+        self.enqueuing = []
+        if self.pending:
+            self.start_enqueue()
+
+    def enqueue_many(self, requests):
+        """
+        批量去重（参考 should_filter）并入队，返回与 requests 一一对应的是否入队，在后台线程中执行
+        """
+        with self.enqueue_lock:
+            should_filter = [self.should_filter(request) for request in requests]
+            filtered = [request for request, check in zip(requests, should_filter) if check]
+            seen = iter(self.df.requests_seen(filtered) if filtered else [])
+            results = []
+            for request, check in zip(requests, should_filter):
+                if check and next(seen):
+                    results.append(False)
+                    continue
+                self.queue.push(request)
+                results.append(True)
+            self.queue_length = len(self.queue)
+            return results
+
+    def enqueue_finished(self, results, requests):
+        for request, enqueued in zip(requests, results):
+            if not enqueued:
+                self.df.log(request, self.spider)
+                if self.stats:
+                    self.stats.inc_value('scheduler/async/dropped', spider=self.spider)
+            elif self.stats:
+                self.stats.inc_value('scheduler/enqueued/redis', spider=self.spider)
+
+    def next_request(self):
+        request = self.prefetched.popleft() if self.prefetched else None
+        if len(self.prefetched) < self.prefetch and not self.popping:
+            self.start_prefetch()
+        if request and self.stats:
+            self.stats.inc_value('scheduler/dequeued/redis', spider=self.spider)
+        return request
+
+    def start_prefetch(self):
+        self.popping = True
+        d = self.defer_to_thread(self.pop_many, self.prefetch - len(self.prefetched))
+        d.addCallback(self.prefetch_finished)
+        d.addErrback(lambda failure: logger.error('Failed to prefetch requests: %s', failure.getTraceback()))
+        d.addBoth(self.prefetch_done)
+
+    def pop_many(self, count):
+        """
+        从种子队列中最多取出 count 个 request，第一个最多等待 idle_before_close 秒，在后台线程中执行。
+        每次最多阻塞 POP_TIMEOUT 秒，调度器关闭时（popping 为 False）不再等待
+        """
+        requests = []
+        deadline = time.time() + self.idle_before_close
+        request = self.queue.pop(min(self.idle_before_close, self.POP_TIMEOUT))
+        while not request and self.popping and time.time() < deadline:
+            request = self.queue.pop(self.POP_TIMEOUT)
+        while request:
+            requests.append(request)
+            if len(requests) >= count:
+                break
+            request = self.queue.pop()
+        self.queue_length = len(self.queue)
+        return requests
+
+    def prefetch_finished(self, requests):
+        if not self.popping:
+            # 调度器已经关闭，持久化时放回种子队列
+            if self.persist:
+                for request in requests:
+                    self.queue.push(request)
+            return
+        self.prefetched.extend(requests)
+        if requests and self.crawler is not None:
+            # engine 得到 None 之后要等到下一次心跳（5 秒）才会再次调用 next_request，预取完成后立即唤醒
+            slot = getattr(self.crawler.engine, 'slot', None)
+            if slot is not None:
+                slot.nextcall.schedule()
+
+    def prefetch_done(self, _):
+        self.popping = False
+
+    def has_pending_requests(self):
+        return self.popping or len(self) > 0
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+BloomFilter 数据导出导入与合并工具，分段 GETRANGE/SETRANGE，不会阻塞 redis，导出导入支持中断后继续
+
+导出：
+python -m scrapy_redis_bloomfilter_block_cluster.snapshot export --url redis://localhost:6379/0 \
+    --key cnblogs:dupefilter --bit 32 --hash-number 15 --block-num 1 /data/cnblogs_dupefilter
+导入：
+python -m scrapy_redis_bloomfilter_block_cluster.snapshot restore --url redis://localhost:6379/0 \
+    --key cnblogs:dupefilter --bit 32 --hash-number 15 --block-num 1 /data/cnblogs_dupefilter
+合并（将 --source 的数据合并到 --key 中，参数必须相同）：
+python -m scrapy_redis_bloomfilter_block_cluster.snapshot merge --url redis://localhost:6379/0 \
+    --key cnblogs2:dupefilter --source cnblogs:dupefilter --bit 32 --hash-number 15 --block-num 1
+
+redis 集群使用 --cluster，此时 --url 为任一集群节点
+导出时不加 --block-placement、导入时加上 --block-placement slots 即可将已有数据迁移到均匀分布的 block 中
+BLOOMFILTER_BLOCK_ROUTER 为 'jump' 的数据需要加上 --block-router jump，与写入时不同时报错
+"""
+import argparse
+import sys
+from scrapy.utils.misc import load_object
+from . import connection, defaults
+from .bloomfilter import get_backend_params
+
+
+def print_progress(block, done, total):
+    sys.stdout.write('\rblock %d: %d / %d bytes (%.1f%%)' % (block, done, total, done * 100.0 / total))
+    if done >= total:
+        sys.stdout.write('\n')
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export or restore bloom filter blocks in chunks.')
+    parser.add_argument('action', choices=['export', 'restore', 'merge'])
+    parser.add_argument('directory', nargs='?', help='snapshot directory, not used by merge')
+    parser.add_argument('--url', required=True, help='redis url')
+    parser.add_argument('--cluster', action='store_true', help='connect to a redis cluster')
+    parser.add_argument('--key', required=True, help='bloom filter key, e.g. spider:dupefilter')
+    parser.add_argument('--bit', type=int, default=32)
+    parser.add_argument('--source', action='append', default=[],
+                        help='bloom filter key merged into --key, can be repeated')
+    parser.add_argument('--hash-number', type=int, default=15)
+    parser.add_argument('--block-num', type=int, default=1)
+    parser.add_argument('--hash-scheme', type=int, default=1)
+    parser.add_argument('--block-placement', choices=['slots'], default=None,
+                        help="block key placement, 'slots' spreads blocks over cluster masters with hash tags")
+    parser.add_argument('--block-router', choices=['legacy', 'jump'], default='legacy',
+                        help='how a fingerprint selects its block, must match the one the data was written with')
+    parser.add_argument('--class', dest='bloomfilter_cls',
+                        default='scrapy_redis_bloomfilter_block_cluster.bloomfilter.BloomFilter')
+    parser.add_argument('--chunk-size', type=int, default=1 << 20, help='bytes per GETRANGE/SETRANGE')
+    parser.add_argument('--overwrite', action='store_true', help='delete existing keys before restoring')
+    args = parser.parse_args(argv)
+    if args.action == 'merge' and not args.source:
+        parser.error('merge requires at least one --source')
+    if args.action != 'merge' and not args.directory:
+        parser.error('%s requires a directory' % args.action)
+
+    if args.cluster:
+        server = connection.get_redis_cluster(url=args.url)
+    else:
+        server = connection.get_redis(url=args.url)
+    kwargs = {'hash_scheme': args.hash_scheme, 'block_router': args.block_router}
+    if args.block_placement:
+        kwargs['block_placement'] = args.block_placement
+    bloomfilter_cls = load_object(defaults.BLOOMFILTER_BACKENDS_BASE.get(args.bloomfilter_cls, args.bloomfilter_cls))
+    kwargs = get_backend_params(bloomfilter_cls, kwargs)
+    bf = bloomfilter_cls(server, args.key, args.bit, args.hash_number, args.block_num, **kwargs)
+    if args.action == 'merge':
+        sources = [bloomfilter_cls(server, key, args.bit, args.hash_number, args.block_num, **kwargs)
+                   for key in args.source]
+        bf.merge(sources, chunk_size=args.chunk_size, progress=print_progress)
+    elif args.action == 'export':
+        bf.export(args.directory, chunk_size=args.chunk_size, progress=print_progress)
+    else:
+        bf.restore(args.directory, chunk_size=args.chunk_size, progress=print_progress, overwrite=args.overwrite)
+
+
+if __name__ == '__main__':
+    main()
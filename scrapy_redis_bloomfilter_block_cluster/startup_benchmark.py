@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+启动耗时测试，每次在一个新的 python 进程中导入调度器相关模块并创建去重实例（不访问 redis），统计导入耗时、
+创建去重实例耗时以及进程总耗时，用于评估由调度系统启动大量短时间运行的爬虫进程时的启动开销。创建去重实例时
+不应该访问 redis（BLOOMFILTER_USE_BITFIELD 为 'auto' 时第一次去重时才探测），子进程统计创建期间的网络连接次数：
+python -m scrapy_redis_bloomfilter_block_cluster.startup_benchmark --runs 20 --lock-num 4096
+
+--setting NAME=VALUE 可以重复多次，覆盖传递给去重类的 scrapy 配置，如 --setting REDIS_CLUSTER_URL=redis://localhost:7001/
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+CHILD_SCRIPT = """
+import json
+import socket
+import sys
+import time
+connections = []
+connect = socket.socket.connect
+def count_connect(sock, address):
+    connections.append(address)
+    return connect(sock, address)
+socket.socket.connect = count_connect
+start = time.perf_counter()
+from scrapy.settings import Settings
+from scrapy.utils.misc import load_object
+from scrapy_redis_bloomfilter_block_cluster import dupefilter, queue, scheduler
+imported = time.perf_counter()
+settings = Settings(json.loads(sys.argv[1]))
+df = load_object(settings['DUPEFILTER_CLASS']).from_settings(settings)
+created = time.perf_counter()
+print(json.dumps({
+    'import': imported - start,
+    'create': created - imported,
+    'connections': len(connections),
+    'modules': [name for name in ('rediscluster', 'redis.sentinel', 'numpy') if name in sys.modules],
+}))
+"""
+
+
+def run_once(settings):
+    start = time.perf_counter()
+    output = subprocess.check_output([sys.executable, '-c', CHILD_SCRIPT, json.dumps(settings)])
+    result = json.loads(output.decode().strip().splitlines()[-1])
+    result['total'] = time.perf_counter() - start
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the startup cost of the scheduler components.')
+    parser.add_argument('--runs', type=int, default=10, help='number of fresh processes')
+    parser.add_argument('--dupefilter-class',
+                        default='scrapy_redis_bloomfilter_block_cluster.dupefilter.LockRFPDupeFilter')
+    parser.add_argument('--lock-num', type=int, default=16)
+    parser.add_argument('--setting', action='append', default=[], metavar='NAME=VALUE',
+                        help='extra scrapy setting, can be repeated')
+    args = parser.parse_args(argv)
+
+    settings = {'DUPEFILTER_CLASS': args.dupefilter_class, 'DUPEFILTER_LOCK_NUM': args.lock_num}
+    for setting in args.setting:
+        name, _, value = setting.partition('=')
+        settings[name] = value
+
+    results = [run_once(settings) for _ in range(args.runs)]
+    for name in ('import', 'create', 'total'):
+        values = [result[name] * 1000 for result in results]
+        print('%-6s median %8.1f ms, min %8.1f ms, max %8.1f ms' % (name, statistics.median(values), min(values),
+                                                                    max(values)))
+    print('optional modules imported: %s' % (', '.join(results[-1]['modules']) or 'none'))
+    print('network connections while starting: %d' % max(result['connections'] for result in results))
+
+
+if __name__ == '__main__':
+    main()
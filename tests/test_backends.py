@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+使用 fakeredis 测试 defaults.BLOOMFILTER_BACKENDS_BASE 中注册的所有去重后端：
+python -m pytest tests
+"""
+import hashlib
+
+import pytest
+import redis
+from redis.exceptions import ResponseError
+
+fakeredis = pytest.importorskip('fakeredis')
+
+from scrapy_redis_bloomfilter_block_cluster import defaults
+from scrapy_redis_bloomfilter_block_cluster.bloomfilter import (BloomFilter, CuckooFilter, MmapBloomFilter,
+                                                                RedisBloomFilter, get_backend_params)
+
+
+def load_backend(name):
+    module, _, cls = defaults.BLOOMFILTER_BACKENDS_BASE[name].rpartition('.')
+    return getattr(__import__(module, fromlist=[cls]), cls)
+
+
+def fingerprints(start, stop):
+    return [hashlib.sha1(str(i).encode()).hexdigest() for i in range(start, stop)]
+
+
+def has_redisbloom(server):
+    try:
+        server.execute_command('BF.EXISTS', 'probe', 'probe')
+    except ResponseError:
+        return False
+    return True
+
+
+# 每个后端的测试参数，容量足够小的误判率
+BACKEND_PARAMS = {
+    'bitmap': {'hash_scheme': 2},
+    'blocked': {'hash_scheme': 2},
+    'counting': {},
+    'cuckoo': {},
+    'mmap': {'hash_scheme': 2},
+    'redisbloom': {},
+    'rotating': {'hash_scheme': 2},
+    'scalable': {'hash_scheme': 2},
+}
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeStrictRedis()
+
+
+@pytest.fixture(params=sorted(defaults.BLOOMFILTER_BACKENDS_BASE))
+def bf(request, server, tmp_path):
+    name = request.param
+    params = dict(BACKEND_PARAMS[name])
+    if name == 'mmap':
+        params['directory'] = str(tmp_path)
+        server = None
+    if name == 'redisbloom' and not has_redisbloom(server):
+        pytest.skip('fakeredis without RedisBloom support')
+    return load_backend(name)(server, 'test:dupefilter', 20, 7, 2, **params)
+
+
+def test_backend_names():
+    assert set(BACKEND_PARAMS) == set(defaults.BLOOMFILTER_BACKENDS_BASE)
+
+
+def test_single_value(bf):
+    fp, other = fingerprints(0, 2)
+    assert not bf.exists(fp)
+    bf.insert(fp)
+    assert bf.exists(fp)
+    assert not bf.exists(other)
+    assert not bf.test_and_set(other)
+    assert bf.test_and_set(other)
+    assert bf.exists(other)
+
+
+def test_batch(bf):
+    values = fingerprints(0, 200)
+    assert bf.exists_many(values) == [False] * 200
+    bf.insert_many(values[:100])
+    assert bf.exists_many(values[:100]) == [True] * 100
+    assert not any(bf.exists_many(values[100:]))
+    assert bf.seen_many(values[50:150]) == [True] * 50 + [False] * 50
+    assert bf.exists_many(values[:150]) == [True] * 150
+
+
+def test_batch_duplicates_in_same_batch(bf):
+    fp = fingerprints(0, 1)[0]
+    assert bf.seen_many([fp, fp]) == [False, True]
+
+
+def test_empty_values(bf):
+    assert bf.exists_many([]) == []
+    assert bf.seen_many([]) == []
+    bf.insert_many([])
+    bf.insert_many(['', None])
+    assert bf.exists_many(['', None]) == [False, False]
+
+
+def test_clear(bf):
+    values = fingerprints(0, 10)
+    bf.insert_many(values)
+    bf.clear()
+    assert not any(bf.exists_many(values))
+
+
+def test_probe_bitfield(server):
+    assert BloomFilter(server, 'test:dupefilter', 20, 7, 1).use_bitfield
+    assert not BloomFilter(server, 'test:dupefilter', 20, 7, 1, use_bitfield=False).use_bitfield
+    assert not BloomFilter(None, 'test:dupefilter', 20, 7, 1).use_bitfield
+
+
+def test_probe_bitfield_lazy():
+    # 构造时不访问 redis，redis 不可用时也能创建
+    server = redis.StrictRedis(port=1)
+    for name in ('bitmap', 'rotating'):
+        load_backend(name)(server, 'test:dupefilter', 20, 7, 1)
+    bf = BloomFilter(server, 'test:dupefilter', 20, 7, 1)
+    assert bf.bitfield == 'auto'
+    with pytest.raises(redis.ConnectionError):
+        bf.exists(fingerprints(0, 1)[0])
+
+
+def test_probe_bitfield_unsupported(server, monkeypatch):
+    execute_command = server.execute_command
+
+    def without_bitfield(*args, **kwargs):
+        if args[0] == 'BITFIELD':
+            raise ResponseError("unknown command 'BITFIELD'")
+        return execute_command(*args, **kwargs)
+
+    monkeypatch.setattr(server, 'execute_command', without_bitfield)
+    bf = BloomFilter(server, 'test:dupefilter', 20, 7, 1, hash_scheme=2)
+    assert not bf.use_bitfield
+    fp = fingerprints(0, 1)[0]
+    assert not bf.test_and_set(fp)
+    assert bf.exists(fp)
+
+
+def test_probe_redisbloom(server):
+    if has_redisbloom(server):
+        assert RedisBloomFilter(server, 'test:dupefilter', 20, 7, 1).use_insert
+    else:
+        with pytest.raises(ValueError):
+            RedisBloomFilter(server, 'test:dupefilter', 20, 7, 1)
+
+
+def test_common_params_ignored():
+    params = {'hash_scheme': 2, 'use_bitfield': True, 'block_placement': 'slots', 'block_router': 'jump',
+              'directory': '.'}
+    assert 'use_bitfield' not in get_backend_params(CuckooFilter, params)
+    assert 'block_placement' not in get_backend_params(MmapBloomFilter, params)
+    assert set(get_backend_params(RedisBloomFilter, params)) == {'block_placement', 'block_router', 'directory'}
+    assert get_backend_params(BloomFilter, {'hash_scheme': 2}) == {'hash_scheme': 2}
+
+
+@pytest.mark.parametrize('name', sorted(defaults.BLOOMFILTER_BACKENDS_BASE))
+def test_common_params_accepted(name, server, tmp_path):
+    if name == 'redisbloom' and not has_redisbloom(server):
+        pytest.skip('fakeredis without RedisBloom support')
+    params = {'hash_scheme': 2, 'use_bitfield': 'auto', 'block_placement': 'slots', 'block_router': 'jump'}
+    backend_cls = load_backend(name)
+    if backend_cls is MmapBloomFilter:
+        params['directory'] = str(tmp_path)
+    backend_cls(server, 'test:dupefilter', 20, 7, 2, **get_backend_params(backend_cls, params))
+
+
+def test_counting_stats(server):
+    bf = load_backend('counting')(server, 'test:dupefilter', 12, 7, 2, counter_bits=4)
+    bf.insert_many(fingerprints(0, 10))
+    stats = bf.get_stats()
+    assert stats['counters'] == (1 << 12) // 4 * 2
+    assert stats['bits'] == (1 << 12) * 2
+    assert 0 < stats['set_bits'] <= 70
+    assert stats['fill_ratio'] == stats['set_bits'] / stats['counters']
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+使用 fakeredis 测试 BloomFilter 的哈希与 block 选择、导出导入、合并以及可扩展、轮转 BloomFilter：
+python -m pytest tests
+"""
+import hashlib
+import json
+import os
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+
+from scrapy_redis_bloomfilter_block_cluster import bloomfilter
+from scrapy_redis_bloomfilter_block_cluster.bloomfilter import (BloomFilter, RotatingBloomFilter, ScalableBloomFilter,
+                                                                get_block_index, jump_hash)
+
+
+def fingerprints(start, stop):
+    return [hashlib.sha1(str(i).encode()).hexdigest() for i in range(start, stop)]
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeStrictRedis()
+
+
+class Interrupt(Exception):
+    pass
+
+
+def interrupt_after(count):
+    """
+    返回 progress 回调，第 count 次调用时抛出 Interrupt，模拟中断
+    """
+    calls = []
+
+    def progress(block, done, total):
+        calls.append((block, done, total))
+        if len(calls) == count:
+            raise Interrupt()
+    return progress
+
+
+@pytest.mark.parametrize('hash_scheme', [2, 3])
+@pytest.mark.parametrize('block_num,block_router', [(1, 'legacy'), (5, 'legacy'), (300, 'legacy'), (5, 'jump'),
+                                                    (5000, 'jump')])
+def test_vectorized_hash(server, hash_scheme, block_num, block_router):
+    pytest.importorskip('numpy')
+    bf = BloomFilter(server, 'test:dupefilter', 20, 7, block_num, hash_scheme, block_router=block_router)
+    values = fingerprints(0, 100) + ['']
+    assert bf.hash_array(values) is not None
+    assert bf.hash_many(values) == [(bf.get_redis_name(value), bf.get_offsets(value)) for value in values[:-1]] + [None]
+    groups = {}
+    for index, value in enumerate(values[:-1]):
+        indexes, offsets = groups.setdefault(bf.get_redis_name(value), ([], []))
+        indexes.append(index)
+        offsets.extend(bf.get_offsets(value))
+    assert bf.group_offsets(values) == groups
+
+
+def test_vectorized_hash_small_batch(server):
+    bf = BloomFilter(server, 'test:dupefilter', 20, 7, 5, 3)
+    assert bf.hash_array(fingerprints(0, bloomfilter.VECTORIZE_MIN_VALUES - 1)) is None
+    assert BloomFilter(server, 'test:dupefilter', 20, 7, 5, 1).hash_array(fingerprints(0, 100)) is None
+
+
+def test_jump_hash():
+    keys = [int(value[:8], 16) for value in fingerprints(0, 2000)]
+    for num_buckets in (1, 7, 100):
+        assert all(0 <= jump_hash(key, num_buckets) < num_buckets for key in keys)
+    # 增加 bucket 时只有移动到新增 bucket 中的 key 改变
+    for key in keys:
+        before, after = jump_hash(key, 10), jump_hash(key, 11)
+        assert after in (before, 10)
+    moved = sum(jump_hash(key, 10) != jump_hash(key, 11) for key in keys)
+    assert 0 < moved < len(keys) / 5
+
+
+def test_block_router_mapping():
+    values = fingerprints(0, 1000)
+    assert [get_block_index(value, 5) for value in values] == [int(value[:2], 16) % 5 for value in values]
+    assert [get_block_index(value, 300) for value in values] == [int(value[:3], 16) % 300 for value in values]
+    assert [get_block_index(value, 5, 'jump') for value in values] == \
+        [jump_hash(int(value[:8], 16), 5) for value in values]
+    # jump 时 block 均匀分布
+    counts = [0] * 4
+    for value in values:
+        counts[get_block_index(value, 4, 'jump')] += 1
+    assert min(counts) > 200
+
+
+def test_block_router_many_blocks(server):
+    with pytest.raises(ValueError):
+        BloomFilter(server, 'test:dupefilter', 10, 3, 5000)
+    with pytest.raises(ValueError):
+        BloomFilter(server, 'test:dupefilter', 10, 3, 5, block_router='unknown')
+    bf = BloomFilter(server, 'test:dupefilter', 10, 3, 5000, 2, block_router='jump')
+    values = fingerprints(0, 100)
+    assert max(get_block_index(value, 5000, 'jump') for value in values) > 4096
+    assert bf.seen_many(values) == [False] * 100
+    assert bf.exists_many(values) == [True] * 100
+
+
+def test_binary_fingerprint(server):
+    bf = BloomFilter(server, 'test:dupefilter', 20, 7, 300, 3)
+    values = fingerprints(0, 100)
+    binaries = [bytes.fromhex(value) for value in values]
+    for value, binary in zip(values, binaries):
+        assert bf.get_redis_name(binary) == bf.get_redis_name(value)
+        assert bf.get_offsets(binary) == bf.get_offsets(value)
+        assert get_block_index(binary, 5000, 'jump') == get_block_index(value, 5000, 'jump')
+    assert bf.hash_many(binaries) == bf.hash_many(values)
+    assert bf.seen_many(binaries[:50]) == [False] * 50
+    assert bf.exists_many(values) == [True] * 50 + [False] * 50
+    assert bf.test_and_set(values[60]) is False
+    assert bf.exists(binaries[60])
+
+
+def test_export_restore(server, tmp_path):
+    source = BloomFilter(server, 'test:source', 16, 7, 2, 2)
+    values = fingerprints(0, 1000)
+    source.insert_many(values)
+    directory = str(tmp_path)
+    # 中断后再次导出从中断的位置继续
+    with pytest.raises(Interrupt):
+        source.export(directory, chunk_size=1024, progress=interrupt_after(3))
+    with open(os.path.join(directory, 'manifest.json')) as f:
+        assert json.load(f)['blocks']['0']['offset'] == 3 * 1024
+    source.export(directory, chunk_size=1024)
+
+    target = BloomFilter(server, 'test:target', 16, 7, 2, 2)
+    with pytest.raises(Interrupt):
+        target.restore(directory, chunk_size=1024, progress=interrupt_after(5))
+    with open(os.path.join(directory, 'restore.json')) as f:
+        assert json.load(f)['blocks']['0'] == 5 * 1024
+    # 其他 key 不能使用中断的导入进度
+    with pytest.raises(ValueError):
+        BloomFilter(server, 'test:other', 16, 7, 2, 2).restore(directory)
+    target.restore(directory, chunk_size=4096)
+    assert not os.path.exists(os.path.join(directory, 'restore.json'))
+    for name, source_name in zip(target.get_redis_names(), source.get_redis_names()):
+        assert server.get(name) == server.get(source_name)
+    assert target.exists_many(values) == [True] * 1000
+    # 目标 key 已经存在时需要 overwrite
+    with pytest.raises(ValueError):
+        target.restore(directory)
+    target.restore(directory, overwrite=True)
+    with pytest.raises(ValueError):
+        BloomFilter(server, 'test:other', 16, 7, 4, 2).restore(directory)
+
+
+@pytest.mark.parametrize('other_server', [False, True])
+def test_merge_placements(server, other_server):
+    source_server = fakeredis.FakeStrictRedis() if other_server else server
+    source = BloomFilter(source_server, 'test:source', 16, 7, 4, 2)
+    target = BloomFilter(server, 'test:target', 16, 7, 4, 2, block_placement='slots')
+    values = fingerprints(0, 1000)
+    source.insert_many(values[:500])
+    target.insert_many(values[500:])
+    target.merge([source], chunk_size=1024)
+    assert target.exists_many(values) == [True] * 1000
+    assert not any(target.exists_many(fingerprints(1000, 1100)))
+    with pytest.raises(ValueError):
+        target.merge([BloomFilter(source_server, 'test:source', 16, 7, 4, 2, block_router='jump')])
+
+
+def test_scalable_growth(server):
+    bf = ScalableBloomFilter(server, 'test:dupefilter', 12, 7, 1, error_rate=0.01, sync_count=10, hash_scheme=2)
+    values = fingerprints(0, 2000)
+    for start in range(0, len(values), 10):
+        bf.seen_many(values[start:start + 10])
+    assert len(bf.filters) > 1
+    assert server.hget('test:dupefilter:scalable', 'generations') == str(len(bf.filters)).encode()
+    # 扩展之前的代都已经填充到设计容量
+    for generation, generation_bf in enumerate(bf.filters[:-1]):
+        stats = generation_bf.get_stats()
+        assert stats['fill_ratio'] >= bf.grow_fill_ratio(generation)
+    assert bf.exists_many(values) == [True] * 2000
+    assert bf.get_stats()['error_rate'] < 0.02
+    # 其他实例读取 redis 中的代数
+    other = ScalableBloomFilter(server, 'test:dupefilter', 12, 7, 1, error_rate=0.1, hash_scheme=2)
+    assert len(other.filters) == len(bf.filters)
+    assert other.error_rate == 0.01
+    other.clear()
+    bf.sync()
+    assert len(bf.filters) == 1
+
+
+def test_scalable_duplicates_do_not_grow(server):
+    bf = ScalableBloomFilter(server, 'test:dupefilter', 12, 7, 1, error_rate=0.01, sync_count=10, hash_scheme=2)
+    values = fingerprints(0, 100)
+    for _ in range(20):
+        bf.insert_many(values)
+    assert len(bf.filters) == 1
+
+
+def test_rotating_ttl(server, monkeypatch):
+    now = time.time()
+    monkeypatch.setattr(bloomfilter.time, 'time', lambda: now)
+    window = 3600
+    bf = RotatingBloomFilter(server, 'test:dupefilter', 16, 7, 2, window=window, generations=2, hash_scheme=2)
+    values = fingerprints(0, 100)
+    assert bf.seen_many(values[:50]) == [False] * 50
+    generation = int(now // window)
+    expire_at = (generation + 2) * window
+    for name in bf.get_filters()[-1].get_redis_names():
+        assert abs(server.ttl(name) - (expire_at - now)) <= 2
+
+    # 其他实例删除的 block 重新创建后，EXPIRE_REFRESH_INTERVAL 秒后重新设置过期时间
+    names = bf.get_filters()[-1].get_redis_names()
+    server.delete(*names)
+    bf.insert_many(values[:50])
+    assert [server.ttl(name) for name in names] == [-1] * len(names)
+    now += bf.EXPIRE_REFRESH_INTERVAL
+    bf.insert_many(values[:50])
+    assert all(server.ttl(name) > 0 for name in names)
+
+    # 下一个时间段仍然有效，两个时间段之后失效
+    now += window
+    assert bf.seen_many(values) == [True] * 50 + [False] * 50
+    now += window
+    assert bf.exists_many(values) == [False] * 50 + [True] * 50
+    assert sorted(bf.filters) == [generation + 1, generation + 2]
+    assert set(bf.expired_names) == {generation + 1}
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+使用 fakeredis 测试去重类（需要安装 scrapy）：
+python -m pytest tests
+"""
+import hashlib
+
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('scrapy')
+
+from scrapy_redis_bloomfilter_block_cluster import dupefilter
+from scrapy_redis_bloomfilter_block_cluster.dupefilter import LockRFPDupeFilter
+
+
+class Stats:
+    def __init__(self):
+        self.values = {}
+
+    def inc_value(self, key, count=1, start=0, spider=None):
+        self.values[key] = self.values.get(key, start) + count
+
+
+def fingerprints(start, stop):
+    return [hashlib.sha1(str(i).encode()).hexdigest() for i in range(start, stop)]
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeStrictRedis()
+
+
+@pytest.fixture
+def df(server):
+    df = LockRFPDupeFilter(lock_key='test:lock:', lock_num=16, lock_timeout=10, atomic=False, lock_backoff_max=0.004,
+                           server=server, key='test:dupefilter', debug=False, bit=20, hash_number=7, block_num=1,
+                           bloomfilter_params={'hash_scheme': 2})
+    df.stats = Stats()
+    return df
+
+
+def test_acquire_lock_uncontended(df, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(dupefilter.time, 'sleep', sleeps.append)
+    fp = fingerprints(0, 1)[0]
+    assert not df.locked_seen(fp)
+    assert df.locked_seen(fp)
+    assert sleeps == []
+    assert df.stats.values == {}
+
+
+def test_acquire_lock_backoff(df, server, monkeypatch):
+    fp = fingerprints(0, 1)[0]
+    lock = df.get_lock(fp)
+    # 其他 scrapy 实例持有同一把锁，第 5 次退避后释放
+    holder = server.lock(lock.name, 10)
+    assert holder.acquire(blocking=False)
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) == 5:
+            holder.release()
+
+    monkeypatch.setattr(dupefilter.time, 'sleep', sleep)
+    df.acquire_lock(lock)
+    lock.release()
+    assert len(sleeps) == 5
+    # full jitter：第 n 次在 [0, min(base * 2^n, lock_backoff_max)] 中随机
+    for n, seconds in enumerate(sleeps):
+        assert 0 <= seconds <= min(df.LOCK_BACKOFF_BASE * 2 ** n, df.lock_backoff_max)
+    assert df.stats.values['bloomfilter/lock/contention'] == 1
+    assert df.stats.values['bloomfilter/lock/wait_time'] >= 0
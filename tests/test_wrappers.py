@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+使用 fakeredis 测试放在 BloomFilter 前面的包装（LocalCacheFilter、WriteBehindFilter）：
+python -m pytest tests
+"""
+import hashlib
+
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+
+from scrapy_redis_bloomfilter_block_cluster.bloomfilter import BloomFilter, LocalCacheFilter, WriteBehindFilter
+
+
+class Stats:
+    """
+    只记录 WriteBehindFilter 使用的 scrapy stats 方法
+    """
+    def __init__(self):
+        self.values = {}
+
+    def inc_value(self, key, count=1):
+        self.values[key] = self.values.get(key, 0) + count
+
+    def set_value(self, key, value):
+        self.values[key] = value
+
+    def max_value(self, key, value):
+        self.values[key] = max(self.values.get(key, value), value)
+
+
+def fingerprints(start, stop):
+    return [hashlib.sha1(str(i).encode()).hexdigest() for i in range(start, stop)]
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeStrictRedis()
+
+
+@pytest.fixture
+def bf(server):
+    return BloomFilter(server, 'test:dupefilter', 20, 7, 1, hash_scheme=2)
+
+
+def test_local_cache_empty_values(bf):
+    cache = LocalCacheFilter(bf, 10)
+    cache.insert('')
+    cache.insert(None)
+    cache.insert_many(['', None])
+    assert not cache.cache
+    assert not cache.exists('')
+    assert cache.exists_many(['', None]) == [False, False]
+
+
+def test_local_cache_hit(bf):
+    cache = LocalCacheFilter(bf, 2)
+    values = fingerprints(0, 3)
+    cache.insert_many(values)
+    assert list(cache.cache) == values[1:]
+    bf.clear()
+    # 缓存中的值不再访问 redis，被淘汰的值访问 redis
+    assert cache.exists_many(values) == [False, True, True]
+
+
+def test_write_behind_flush_on_size(bf):
+    stats = Stats()
+    buffered = WriteBehindFilter(bf, size=3, interval=3600, stats=stats)
+    values = fingerprints(0, 4)
+    assert buffered.seen_many(values[:2]) == [False, False]
+    # 缓冲中的值已经存在，但还没有写入 redis
+    assert buffered.exists_many(values) == [True, True, False, False]
+    assert bf.exists_many(values[:2]) == [False, False]
+    assert buffered.seen_many(values[1:3]) == [True, False]
+    assert bf.exists_many(values) == [True, True, True, False]
+    assert not buffered.buffer
+    assert stats.values['bloomfilter/write_behind/flushes'] == 1
+    assert stats.values['bloomfilter/write_behind/flushed'] == 3
+    assert stats.values['bloomfilter/write_behind/max_depth'] == 3
+
+
+def test_write_behind_flush_on_interval(bf):
+    buffered = WriteBehindFilter(bf, size=1000, interval=5)
+    values = fingerprints(0, 2)
+    buffered.insert(values[0])
+    assert not bf.exists(values[0])
+    buffered.last_flush -= 5
+    buffered.insert(values[1])
+    assert bf.exists_many(values) == [True, True]
+    assert not buffered.buffer
+
+
+def test_write_behind_flush_on_close(bf):
+    buffered = WriteBehindFilter(bf, size=1000, interval=3600)
+    values = fingerprints(0, 10)
+    buffered.insert_many(values + ['', None])
+    assert buffered.test_and_set(values[0])
+    assert not any(bf.exists_many(values))
+    buffered.close()
+    assert bf.exists_many(values) == [True] * 10
+    assert not buffered.buffer
+
+
+def test_write_behind_flush_failure(bf, monkeypatch):
+    buffered = WriteBehindFilter(bf, size=1, interval=3600)
+
+    def insert_many(values):
+        raise ConnectionError()
+
+    monkeypatch.setattr(bf, 'insert_many', insert_many)
+    value = fingerprints(0, 1)[0]
+    with pytest.raises(ConnectionError):
+        buffered.insert(value)
+    # 写入失败的值保留在缓冲中，下一次重新写入
+    assert list(buffered.buffer) == [value]
+    monkeypatch.undo()
+    buffered.flush()
+    assert bf.exists(value)